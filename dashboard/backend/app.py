@@ -6,7 +6,7 @@ Flask Backend - IoT Health Monitoring System
 - Saves to Firebase Cloud
 """
 
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
 from opcua import Client as OPCUAClient
@@ -16,12 +16,20 @@ import joblib
 import numpy as np
 import json
 import ssl
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import os
 import threading
 import traceback
+import time
+import random
+import atexit
+from collections import OrderedDict
 from opcua import ua
+from vitals_frame import is_frame, decode_frame
+from stream_monitor import StreamMonitor
+from recent_history import RecentHistory, FLAG_BITS, to_json, to_bytes
+from sinks import Sink, FileSink, SinkDispatcher
 
 # Load environment variables
 load_dotenv()
@@ -39,23 +47,61 @@ MQTT_USERNAME = os.getenv('MQTT_USERNAME')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
 MQTT_TOPIC_HR = os.getenv('MQTT_TOPIC_HR')
 MQTT_TOPIC_SPO2 = os.getenv('MQTT_TOPIC_SPO2')
+MQTT_TOPIC_VITALS = os.getenv('MQTT_TOPIC_VITALS', 'sensors/vitals')
+DEFAULT_DEVICE_ID = os.getenv('DEFAULT_DEVICE_ID', 'default')
 
 OPCUA_SERVER_URL = os.getenv('OPCUA_SERVER_URL')
 OPCUA_USER = os.getenv('OPCUA_USER', 'yourservername')
 OPCUA_PASSWORD = os.getenv('OPCUA_PASSWORD', 'yourpassword')
 OPCUA_NAMESPACE = os.getenv('OPCUA_NAMESPACE', 'HealthMonitoring')
 
+# Sink fan-out: per-sink routine backlog/batch, critical readings bypass routine traffic
+CRITICAL_LATENCY_SLO_MS = float(os.getenv('CRITICAL_LATENCY_SLO_MS', 500))
+ROUTINE_QUEUE_SIZE = int(os.getenv('ROUTINE_QUEUE_SIZE', 200))
+ROUTINE_BATCH_SIZE = int(os.getenv('ROUTINE_BATCH_SIZE', 20))
+FILE_SINK_PATH = os.getenv('FILE_SINK_PATH')  # e.g. state/readings.jsonl; unset = disabled
+
+# Online drift / data-quality monitor
+MONITOR_MAX_DEVICES = int(os.getenv('MONITOR_MAX_DEVICES', 1000))
+MONITOR_BASELINE_SIZE = int(os.getenv('MONITOR_BASELINE_SIZE', 500))
+MONITOR_DECAY = float(os.getenv('MONITOR_DECAY', 0.995))
+# Monitor bucket for payloads too broken to tell which device sent them
+UNKNOWN_DEVICE_ID = 'unknown'
+
+# In-memory recent history: capacity counts readings, sized to cover RECENT_HISTORY_MINUTES.
+# Every processed message is a reading: the JSON publisher sends HR and SpO2 separately every
+# DATA_GENERATION_INTERVAL (2 s), i.e. 1 reading/s; binary frames give one reading per sample.
+RECENT_HISTORY_MINUTES = float(os.getenv('RECENT_HISTORY_MINUTES', 60))
+RECENT_HISTORY_READINGS_PER_SECOND = float(os.getenv('RECENT_HISTORY_READINGS_PER_SECOND', 1.0))
+RECENT_HISTORY_CAPACITY = int(os.getenv('RECENT_HISTORY_CAPACITY', 0)) or max(
+    1, round(RECENT_HISTORY_MINUTES * 60 * RECENT_HISTORY_READINGS_PER_SECOND))
+RECENT_HISTORY_MAX_DEVICES = int(os.getenv('RECENT_HISTORY_MAX_DEVICES', 1000))
+
+# State snapshots for warm restarts
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'state/backend_snapshot.json')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 10))
+SNAPSHOT_VERSION = 3
+
 # =========================
 # GLOBAL VARIABLES
 # =========================
 latest_hr = 70
 latest_spo2 = 98
 latest_sensor_timestamp = None  
+latest_device_id = DEFAULT_DEVICE_ID
+# device_id -> last processed reading (seeds that device's next JSON reading);
+# least recently updated devices are evicted beyond MONITOR_MAX_DEVICES
+device_state = OrderedDict()
+device_state_lock = threading.Lock()
 mqtt_client = None
 opcua_client = None
 mqtt_connected = False
 opcua_connected = False
 
+stream_monitor = StreamMonitor(MONITOR_MAX_DEVICES, MONITOR_BASELINE_SIZE, MONITOR_DECAY)
+recent_history = RecentHistory(RECENT_HISTORY_CAPACITY, RECENT_HISTORY_MAX_DEVICES)
+sink_dispatcher = SinkDispatcher(CRITICAL_LATENCY_SLO_MS)
+
 # =========================
 # LOAD ML MODELS
 # =========================
@@ -91,6 +137,16 @@ try:
             })
         firebase_ref = db.reference('realtime_data')
         logs_ref = db.reference('logs')
+        # Separate app instance = separate HTTP session for the priority lane
+        try:
+            priority_app = firebase_admin.get_app('priority')
+        except ValueError:
+            priority_app = firebase_admin.initialize_app(cred, {
+                'databaseURL': os.getenv('FIREBASE_DATABASE_URL',
+                                         'https://iot-project-27-default-rtdb.firebaseio.com')
+            }, name='priority')
+        priority_firebase_ref = db.reference('realtime_data', app=priority_app)
+        priority_logs_ref = db.reference('logs', app=priority_app)
         print("✅ Firebase connected!")
     else:
         raise RuntimeError("FIREBASE_CREDENTIALS_PATH not set")
@@ -98,16 +154,37 @@ except Exception as e:
     print(f"⚠️  Firebase initialization failed: {e}")
     firebase_ref = None
     logs_ref = None
+    priority_firebase_ref = None
+    priority_logs_ref = None
 
 # =========================
 # ML PREDICTION FUNCTION
 # =========================
-def predict_health_status(heart_rate, spo2):
+def rule_based_predictions(hr, sp):
+    """Threshold rules used when the models are missing or return no flags"""
+    return {
+        'anomaly': (hr < 40 or hr > 140 or sp < 90),
+        'arrhythmia': 1 if (hr < 45 or hr > 130) else 0,
+        'bradycardia': 1 if hr < 60 else 0,
+        'tachycardia': 1 if hr > 100 else 0
+    }
+
+def is_critical_reading(heart_rate, spo2, predictions):
+    """Critical = rule-based anomaly thresholds (SpO2 < 90, HR > 140, HR < 40) or a model anomaly"""
+    try:
+        hr = int(float(heart_rate))
+        sp = int(float(spo2))
+    except Exception:
+        return bool(predictions.get('anomaly'))
+    return bool(predictions.get('anomaly')) or rule_based_predictions(hr, sp)['anomaly']
+
+def predict_health_status(heart_rate, spo2, device_id=None):
     """
     Run all ML models and generate predictions
-    Input: heart_rate (int|str), spo2 (int|str)
+    Input: heart_rate (int|str), spo2 (int|str), device_id (record in stream_monitor if given)
     Output: dict with predictions and recommendation
     """
+    invalid_fields = []
 
     # Defensive: coerce to ints (if possible)
     try:
@@ -115,12 +192,14 @@ def predict_health_status(heart_rate, spo2):
     except Exception:
         print(f"⚠️ predict_health_status: invalid heart_rate input: {heart_rate!r}. Using 0.")
         hr = 0
+        invalid_fields.append('invalid_heart_rate')
 
     try:
         sp = int(float(spo2))
     except Exception:
         print(f"⚠️ predict_health_status: invalid spo2 input: {spo2!r}. Using 0.")
         sp = 0
+        invalid_fields.append('invalid_spo2')
 
     features = np.array([[hr, sp]])
 
@@ -131,13 +210,16 @@ def predict_health_status(heart_rate, spo2):
         'bradycardia': 0,
         'tachycardia': 0
     }
+    # Raw per-model outputs for the stream monitor (None = model missing or failed)
+    model_flags = dict.fromkeys(predictions)
 
     # Run predictions if models are loaded; print exceptions if any
     if anomaly_model:
         try:
             # some anomaly models require different input; be careful
             anomaly_pred = anomaly_model.predict(features)[0]
-            predictions['anomaly'] = (anomaly_pred == -1 or bool(anomaly_pred))
+            predictions['anomaly'] = bool(anomaly_pred == -1 or bool(anomaly_pred))
+            model_flags['anomaly'] = predictions['anomaly']
         except Exception as e:
             print("⚠️ anomaly_model.predict failed:", e)
             traceback.print_exc()
@@ -145,6 +227,7 @@ def predict_health_status(heart_rate, spo2):
     if arrhythmia_model:
         try:
             predictions['arrhythmia'] = int(arrhythmia_model.predict(features)[0])
+            model_flags['arrhythmia'] = bool(predictions['arrhythmia'])
         except Exception as e:
             print("⚠️ arrhythmia_model.predict failed:", e)
             traceback.print_exc()
@@ -152,6 +235,7 @@ def predict_health_status(heart_rate, spo2):
     if brady_model:
         try:
             predictions['bradycardia'] = int(brady_model.predict(features)[0])
+            model_flags['bradycardia'] = bool(predictions['bradycardia'])
         except Exception as e:
             print("⚠️ brady_model.predict failed:", e)
             traceback.print_exc()
@@ -159,37 +243,35 @@ def predict_health_status(heart_rate, spo2):
     if tachy_model:
         try:
             predictions['tachycardia'] = int(tachy_model.predict(features)[0])
+            model_flags['tachycardia'] = bool(predictions['tachycardia'])
         except Exception as e:
             print("⚠️ tachy_model.predict failed:", e)
             traceback.print_exc()
 
+    rule_preds = rule_based_predictions(hr, sp)
+    fallback = False
+
     # If none of the models are available or all failed, use rule-based fallback
     if not any([anomaly_model, arrhythmia_model, brady_model, tachy_model]):
-        predictions = {
-            'anomaly': (hr < 40 or hr > 140 or sp < 90),
-            'arrhythmia': 1 if (hr < 45 or hr > 130) else 0,
-            'bradycardia': 1 if hr < 60 else 0,
-            'tachycardia': 1 if hr > 100 else 0
-        }
+        predictions = dict(rule_preds)
 
     # If models existed but predictions are all zeros (possible model error), optionally fallback:
     # if all values are falsy here you may still want to run rule-based fallback — optional:
     if not any([predictions['anomaly'], predictions['arrhythmia'], predictions['bradycardia'], predictions['tachycardia']]) and any([anomaly_model, arrhythmia_model, brady_model, tachy_model]):
         # no predicted events from models — but we might still want rule based check to avoid silent misses
         try:
-            rule_preds = {
-                'anomaly': (hr < 40 or hr > 140 or sp < 90),
-                'arrhythmia': 1 if (hr < 45 or hr > 130) else 0,
-                'bradycardia': 1 if hr < 60 else 0,
-                'tachycardia': 1 if hr > 100 else 0
-            }
             # If rule says something is flagged, accept it as a fallback
             if any(rule_preds.values()):
                 print("⚠️ Models returned no flags — using rule-based fallback:", rule_preds)
-                predictions = rule_preds
+                predictions = dict(rule_preds)
+                fallback = True
         except Exception:
             pass
 
+    if device_id is not None:
+        stream_monitor.record_prediction(device_id, hr, sp, model_flags, rule_preds,
+                                         invalid_fields=invalid_fields, fallback=fallback)
+
     status, recommendation = generate_recommendation(predictions, hr, sp)
     return { **predictions, 'status': status, 'recommendation': recommendation }
 
@@ -273,6 +355,20 @@ def generate_recommendation(predictions, heart_rate, spo2):
 # =========================
 # OPC UA FUNCTIONS
 # =========================
+def create_opcua_client():
+    """Create and connect a new OPC UA client (raises on failure)"""
+    client = OPCUAClient(OPCUA_SERVER_URL)
+    # set user/password if provided
+    if OPCUA_USER:
+        try:
+            client.set_user("dtcaproject")
+            client.set_password("dtca")
+        except Exception as e:
+            print(f"⚠️ Failed to set OPC UA authentication: {e}")
+
+    client.connect()
+    return client
+
 def connect_opcua():
     """Create and connect the global OPC UA client"""
     global opcua_client, opcua_connected
@@ -282,16 +378,7 @@ def connect_opcua():
         return False
 
     try:
-        opcua_client = OPCUAClient(OPCUA_SERVER_URL)
-        # set user/password if provided
-        if OPCUA_USER:
-            try:
-                opcua_client.set_user("dtcaproject")
-                opcua_client.set_password("dtca")
-            except Exception:
-                print(f"⚠️ Failed to set OPC UA authentication: {e}")
-
-        opcua_client.connect()
+        opcua_client = create_opcua_client()
         opcua_connected = True
         print(f"✅ Connected to OPC UA Server: {OPCUA_SERVER_URL}")
         return True
@@ -304,20 +391,20 @@ def connect_opcua():
 from opcua import ua
 import traceback
 
-def write_to_opcua(heart_rate, spo2, predictions):
+def write_to_opcua(heart_rate, spo2, predictions, client=None):
     """
     Typed write + immediate readback diagnostics for OPC UA nodes.
-    Assumes opcua_client is already connected and authenticated.
+    Assumes the client (default: global opcua_client) is already connected and authenticated.
     """
-    global opcua_client
-    if not opcua_client:
+    client = client or opcua_client
+    if not client:
         print("⚠️ No OPC UA client available for writing.")
-        return
+        return False
 
     try:
         # get nodes either via browse path or fallback to nodeids (use what's working)
         try:
-            objects = opcua_client.get_objects_node()
+            objects = client.get_objects_node()
             health_monitoring = objects.get_child([f"3:{OPCUA_NAMESPACE}"])
             hr_node = health_monitoring.get_child(["3:HeartRate"])
             spo2_node = health_monitoring.get_child(["3:SpO2"])
@@ -332,15 +419,15 @@ def write_to_opcua(heart_rate, spo2, predictions):
         except Exception as e:
             # fallback node ids you showed in UA Expert
             print("ℹ️ Browse path failed, using direct node ids as fallback.")
-            hr_node = opcua_client.get_node("ns=3;i=1020")
-            spo2_node = opcua_client.get_node("ns=3;i=1021")
-            timestamp_node = opcua_client.get_node("ns=3;i=1022")
-            arrhythmia_node = opcua_client.get_node("ns=3;i=1023")
-            anomaly_node = opcua_client.get_node("ns=3;i=1024")
-            brady_node = opcua_client.get_node("ns=3;i=1025")
-            tachy_node = opcua_client.get_node("ns=3;i=1026")
-            status_node = opcua_client.get_node("ns=3;s=1027")
-            rec_node = opcua_client.get_node("ns=3;s=1028")
+            hr_node = client.get_node("ns=3;i=1020")
+            spo2_node = client.get_node("ns=3;i=1021")
+            timestamp_node = client.get_node("ns=3;i=1022")
+            arrhythmia_node = client.get_node("ns=3;i=1023")
+            anomaly_node = client.get_node("ns=3;i=1024")
+            brady_node = client.get_node("ns=3;i=1025")
+            tachy_node = client.get_node("ns=3;i=1026")
+            status_node = client.get_node("ns=3;s=1027")
+            rec_node = client.get_node("ns=3;s=1028")
 
         # Build typed Variants (match your UA Expert types)
         hr_variant = ua.Variant(int(heart_rate), ua.VariantType.Int32)
@@ -390,10 +477,12 @@ def write_to_opcua(heart_rate, spo2, predictions):
         readback(status_node, "Status")
         readback(rec_node, "Recommendation")
         readback(timestamp_node, "Timestamp")
+        return True
 
     except Exception as e:
         # print(f"⚠️ OPC UA typed write/readback failed: {e}")
         traceback.print_exc()
+        return False
 
 # Alternative: Simple node finder helper function
 def find_and_print_node_ids():
@@ -440,37 +529,287 @@ def find_and_print_node_ids():
 # =========================
 # FIREBASE FUNCTIONS
 # =========================
-def write_to_firebase(heart_rate, spo2, predictions):
-    """Write data to Firebase Realtime Database"""
-    if not firebase_ref:
-        return
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_push_key_lock = threading.Lock()
+_last_push_time = 0
+_last_push_rand = [0] * 12
+
+def generate_push_key():
+    """
+    Generate a Firebase-style push key locally (time-ordered, like ref.push()).
+    Lets a batch of log entries go out in a single multi-path update.
+    """
+    global _last_push_time
+    with _push_key_lock:
+        now = int(time.time() * 1000)
+        if now == _last_push_time:
+            # Same millisecond: increment the random suffix to keep keys ordered
+            i = 11
+            while i >= 0 and _last_push_rand[i] == 63:
+                _last_push_rand[i] = 0
+                i -= 1
+            if i >= 0:
+                _last_push_rand[i] += 1
+        else:
+            _last_push_time = now
+            for i in range(12):
+                _last_push_rand[i] = random.randrange(64)
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return ''.join(reversed(time_chars)) + ''.join(PUSH_CHARS[r] for r in _last_push_rand)
+
+def build_firebase_record(heart_rate, spo2, predictions, timestamp=None):
+    """Shape a reading the way the dashboard reads realtime_data / logs entries"""
+    return {
+        'HeartRate': heart_rate,
+        'SpO2': spo2,
+        'anomaly': predictions['anomaly'],
+        'arrhythmia': predictions['arrhythmia'],
+        'bradycardia': predictions['bradycardia'],
+        'tachycardia': predictions['tachycardia'],
+        'prediction': predictions['status'],
+        'recommendation': predictions['recommendation'],
+        'timestamp': timestamp or datetime.now().isoformat()
+    }
+
+def write_batch_to_firebase(records, realtime=None, logs=None, set_realtime=True):
+    """
+    Set realtime_data to the newest record and write all records to logs in one update
+    records: {push_key: record} in chronological order; rewriting a key overwrites, never duplicates
+    set_realtime: False leaves realtime_data alone (a newer critical reading owns it)
+    """
+    realtime = realtime or firebase_ref
+    logs = logs or logs_ref
+    if not realtime or not records:
+        return False
 
     try:
-        timestamp = datetime.now().isoformat()
+        if set_realtime:
+            realtime.set(list(records.values())[-1])
+        if logs:
+            logs.update(records)
+        print(f"✅ {len(records)} record(s) written to Firebase")
+        return True
+
+    except Exception as e:
+        print(f"⚠️  Firebase batch write failed: {e}")
+        return False
+
+# =========================
+# SINKS
+# =========================
+class OpcUaSink(Sink):
+    """OPC UA nodes only hold the current value, so routine batches coalesce to the newest reading"""
+    name = 'opcua'
+    coalesce = True
+
+    def connect(self, lane):
+        # Routine writes share the global client; the critical lane gets its own session
+        if lane == 'critical':
+            return create_opcua_client()
+        if opcua_client is None and not connect_opcua():
+            raise RuntimeError("OPC UA server unavailable")
+        return opcua_client
+
+    def close(self, conn):
+        global opcua_client, opcua_connected
+        if conn is None:
+            return
+        if conn is opcua_client:
+            # Force the next routine connect() to open a fresh global session
+            opcua_client = None
+            opcua_connected = False
+        conn.disconnect()
+
+    def write(self, readings, conn, current=True):
+        reading = readings[-1]
+        return write_to_opcua(reading['HeartRate'], reading['SpO2'], reading['predictions'], client=conn)
+
+def reading_time(reading):
+    """Sample time of a dispatched reading (readings from older snapshots only have enqueued_at)"""
+    return reading.get('sample_time', reading['enqueued_at'])
+
+class FirebaseSink(Sink):
+    """realtime_data gets the newest reading, logs get every reading (one multi-path update per batch)"""
+    name = 'firebase'
+    current_value = True  # realtime_data
+
+    def connect(self, lane):
+        # Separate app instance = separate HTTP session for the critical lane
+        if lane == 'critical':
+            return priority_firebase_ref, priority_logs_ref
+        return firebase_ref, logs_ref
+
+    def write(self, readings, conn, current=True):
+        realtime, logs = conn
+        return write_batch_to_firebase({
+            r['key']: build_firebase_record(r['HeartRate'], r['SpO2'], r['predictions'],
+                                            timestamp=datetime.fromtimestamp(reading_time(r)).isoformat())
+            for r in readings
+        }, realtime=realtime, logs=logs, set_realtime=current)
+
+def register_sinks():
+    """Register every configured output with the dispatcher (before restore/start)"""
+    if OPCUA_SERVER_URL:
+        sink_dispatcher.register(OpcUaSink(queue_size=ROUTINE_QUEUE_SIZE))
+    if firebase_ref is not None:
+        sink_dispatcher.register(FirebaseSink(max_batch=ROUTINE_BATCH_SIZE, queue_size=ROUTINE_QUEUE_SIZE))
+    if FILE_SINK_PATH:
+        sink_dispatcher.register(FileSink(FILE_SINK_PATH))
 
-        data = {
-            'HeartRate': heart_rate,
-            'SpO2': spo2,
-            'anomaly': predictions['anomaly'],
-            'arrhythmia': predictions['arrhythmia'],
-            'bradycardia': predictions['bradycardia'],
-            'tachycardia': predictions['tachycardia'],
-            'prediction': predictions['status'],
-            'recommendation': predictions['recommendation'],
-            'timestamp': timestamp
-        }
+# =========================
+# STATE SNAPSHOTS
+# =========================
+def build_snapshot():
+    """Collect all restorable state into one JSON-serialisable dict"""
+    return {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': time.time(),
+        'latest': {
+            'HeartRate': latest_hr,
+            'SpO2': latest_spo2,
+            'sensor_timestamp': latest_sensor_timestamp,
+            'device_id': latest_device_id
+        },
+        'devices': device_states(),
+        'monitor': stream_monitor.to_state(),
+        'pending': sink_dispatcher.pending()
+    }
+
+_snapshot_lock = threading.Lock()
+_snapshot_slot = 0
+_snapshot_recent = (None, None)  # (recent_history.appended, header) of the last ring file written
+
+def recent_history_path(slot):
+    """Ring buffer file next to the snapshot; two slots so the JSON always names a complete file"""
+    return f"{os.path.splitext(SNAPSHOT_PATH)[0]}.recent-{slot}.npy"
+
+def save_snapshot():
+    """
+    Write a snapshot atomically (temp file + fsync + rename) so a crash never leaves a torn file.
+    The ring buffers go to a memory-mappable .npy file (alternating between two slots), then the
+    small JSON header that references it.
+    """
+    global _snapshot_slot, _snapshot_recent
+    with _snapshot_lock:
+        try:
+            os.makedirs(os.path.dirname(SNAPSHOT_PATH) or '.', exist_ok=True)
+            snapshot = build_snapshot()
+            appended, header = _snapshot_recent
+            if header is None or appended != recent_history.appended:
+                # Rewrite the rings only when something was appended since the last snapshot
+                appended = recent_history.appended
+                _snapshot_slot ^= 1
+                header = recent_history.save(recent_history_path(_snapshot_slot))
+                _snapshot_recent = (appended, header)
+            snapshot['recent'] = header
+
+            tmp_path = f"{SNAPSHOT_PATH}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, SNAPSHOT_PATH)
+            return True
+        except Exception as e:
+            print(f"⚠️ Snapshot write failed: {e}")
+            return False
+
+PENDING_READING_KEYS = ('HeartRate', 'SpO2', 'predictions', 'enqueued_at')
 
-        # Update realtime data
-        firebase_ref.set(data)
+def restore_snapshot():
+    """
+    Restore state from the last snapshot — call after register_sinks(), before the sinks and MQTT start.
+    Everything is parsed into fresh objects first, so a bad snapshot leaves no partial state behind.
+    A ring buffer file that can't be loaded only drops the recent history.
+    """
+    global latest_hr, latest_spo2, latest_sensor_timestamp, latest_device_id, stream_monitor, recent_history
+    global _snapshot_slot
 
-        # Add to logs
-        if logs_ref:
-            logs_ref.push(data)
+    if not os.path.exists(SNAPSHOT_PATH):
+        print("ℹ️ No state snapshot found — cold start")
+        return False
 
-        print("✅ Data written to Firebase")
+    try:
+        with open(SNAPSHOT_PATH, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        version = snapshot.get('version')
+        if version not in (1, 2, SNAPSHOT_VERSION):
+            print(f"⚠️ Ignoring snapshot with unsupported version: {version!r}")
+            return False
+        if version == 1:
+            # v1 had one critical and one routine queue feeding OPC UA and Firebase together:
+            # nothing in them was written anywhere yet, so replay them to every sink
+            v1_pending = snapshot['pending']
+            snapshot['pending'] = {
+                name: {'critical': list(v1_pending.get('critical', [])),
+                       'routine': list(v1_pending.get('routine', []))}
+                for name in sink_dispatcher.runners
+            }
 
+        latest = snapshot['latest']
+        restored_latest = (latest['HeartRate'], latest['SpO2'], latest['sensor_timestamp'], latest['device_id'])
+        restored_devices = {device_id: dict(state) for device_id, state in snapshot['devices'].items()}
+        monitor = StreamMonitor(MONITOR_MAX_DEVICES, MONITOR_BASELINE_SIZE, MONITOR_DECAY)
+        monitor.load_state(snapshot['monitor'])
+        history = RecentHistory(RECENT_HISTORY_CAPACITY, RECENT_HISTORY_MAX_DEVICES)
+        slot = _snapshot_slot
+        try:
+            if version in (1, 2) and 'recent' in snapshot:
+                # v1/v2 kept the rings inline as base64 JSON
+                history.load_state(snapshot['recent'])
+            elif 'recent' in snapshot:
+                recent = snapshot['recent']
+                path = os.path.join(os.path.dirname(SNAPSHOT_PATH), recent['file'])
+                if path == recent_history_path(0) or path == recent_history_path(1):
+                    # The next save must go to the other slot, never over the file this JSON names
+                    slot = 0 if path == recent_history_path(0) else 1
+                history.load(path, recent)
+        except Exception as e:
+            print(f"⚠️ Recent history restore failed, starting it empty: {e}")
+            history = RecentHistory(RECENT_HISTORY_CAPACITY, RECENT_HISTORY_MAX_DEVICES)
+
+        pending = snapshot['pending']
+        for queues in pending.values():
+            for lane in ('critical', 'routine'):
+                for reading in queues.get(lane, []):
+                    missing = [k for k in PENDING_READING_KEYS if k not in reading]
+                    if missing:
+                        raise ValueError(f"pending reading is missing {missing}")
+                    # Readings saved before push keys were assigned at dispatch get one now
+                    reading.setdefault('key', generate_push_key())
+        age = time.time() - float(snapshot['saved_at'])
     except Exception as e:
-        print(f"⚠️  Firebase write failed: {e}")
+        print(f"⚠️ Snapshot restore failed, starting cold: {e}")
+        traceback.print_exc()
+        return False
+
+    # Safe to rebind: nothing has started yet
+    latest_hr, latest_spo2, latest_sensor_timestamp, latest_device_id = restored_latest
+    for device_id, state in restored_devices.items():
+        remember_device(device_id, state)
+    stream_monitor = monitor
+    recent_history = history
+    _snapshot_slot = slot
+    restored = sink_dispatcher.restore_pending(pending)
+    print(f"♻️ Restored snapshot from {age:.0f}s ago: {len(device_state)} device(s), "
+          f"{restored} pending reading(s), HR={latest_hr}, SpO2={latest_spo2}")
+    return True
+
+def snapshot_worker():
+    """Periodically persist state to SNAPSHOT_PATH"""
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        save_snapshot()
+
+def start_snapshots():
+    """Start periodic snapshots and write a final one on shutdown"""
+    threading.Thread(target=snapshot_worker, name="snapshots", daemon=True).start()
+    atexit.register(save_snapshot)
+    print(f"💾 Snapshots every {SNAPSHOT_INTERVAL:.0f}s → {SNAPSHOT_PATH}")
 
 # =========================
 # MQTT CALLBACKS
@@ -481,8 +820,8 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("✅ Connected to MQTT Broker")
         try:
-            client.subscribe([(MQTT_TOPIC_HR, 1), (MQTT_TOPIC_SPO2, 1)])
-            print(f"📡 Subscribed to: {MQTT_TOPIC_HR}, {MQTT_TOPIC_SPO2}")
+            client.subscribe([(MQTT_TOPIC_HR, 1), (MQTT_TOPIC_SPO2, 1), (MQTT_TOPIC_VITALS, 1)])
+            print(f"📡 Subscribed to: {MQTT_TOPIC_HR}, {MQTT_TOPIC_SPO2}, {MQTT_TOPIC_VITALS}")
         except Exception as e:
             print(f"❌ Subscription failed: {e}")
         mqtt_connected = True
@@ -492,10 +831,37 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     """Callback when MQTT message is received"""
-    global latest_hr, latest_spo2
+    global latest_hr, latest_spo2, latest_sensor_timestamp, latest_device_id
 
+    # Binary combined frames are detected by their magic bytes; anything else is legacy JSON
     try:
-        payload = json.loads(msg.payload.decode())
+        if is_frame(msg.payload):
+            frame = decode_frame(msg.payload)
+            payload = None
+        else:
+            payload = json.loads(msg.payload.decode())
+            if not isinstance(payload, dict):
+                raise ValueError(f"expected a JSON object, got {type(payload).__name__}")
+    except ValueError as e:
+        # Bad frame, invalid UTF-8/JSON or a JSON payload that is not an object
+        stream_monitor.record_invalid(UNKNOWN_DEVICE_ID, 'unparseable_payload')
+        print(f"⚠️  Unparseable MQTT payload on {msg.topic}: {e}")
+        return
+
+    try:
+        if payload is None:
+            handle_vitals_frame(*frame)
+            return
+
+        latest_device_id = payload.get('device_id', DEFAULT_DEVICE_ID)
+
+        # Pair this value with the same device's last reading; the globals only seed unknown devices
+        with device_state_lock:
+            known = device_state.get(latest_device_id)
+        if known:
+            latest_hr = known['HeartRate']
+            latest_spo2 = known['SpO2']
+            latest_sensor_timestamp = known['sensor_timestamp']
 
         # Accept payloads with {"value": 72} or numeric values directly
         if msg.topic == MQTT_TOPIC_HR:
@@ -503,7 +869,10 @@ def on_message(client, userdata, msg):
             try:
                 latest_hr = int(float(raw))
             except Exception:
+                # Counted once here; re-processing the previous value would also count it as valid
+                stream_monitor.record_invalid(latest_device_id, 'unparseable_heart_rate')
                 print(f"⚠️ Could not parse HR value: {raw!r} — keeping previous: {latest_hr}")
+                return
             print(f"💓 Received HR: {latest_hr} BPM")
 
         elif msg.topic == MQTT_TOPIC_SPO2:
@@ -511,24 +880,88 @@ def on_message(client, userdata, msg):
             try:
                 latest_spo2 = int(float(raw))
             except Exception:
+                stream_monitor.record_invalid(latest_device_id, 'unparseable_spo2')
                 print(f"⚠️ Could not parse SpO2 value: {raw!r} — keeping previous: {latest_spo2}")
+                return
             print(f"🫁 Received SpO2: {latest_spo2}%")
 
         # Process data when values are updated
-        process_health_data()
+        latest_sensor_timestamp = payload.get('timestamp', latest_sensor_timestamp)
+        process_health_data(sample_time=parse_sample_time(payload.get('timestamp')))
 
     except Exception as e:
         print(f"⚠️  Error processing MQTT message: {e}")
         traceback.print_exc()
 
-def process_health_data():
-    """Process health data and make predictions"""
+def handle_vitals_frame(device_id, samples):
+    """Process every sample of a decoded binary vitals frame"""
+    global latest_hr, latest_spo2, latest_sensor_timestamp, latest_device_id
+
+    print(f"📦 Received frame from {device_id or DEFAULT_DEVICE_ID}: {len(samples)} sample(s)")
+
+    for timestamp, hr, spo2 in samples:
+        try:
+            sensor_timestamp = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+        except (ValueError, OverflowError, OSError) as e:
+            # Finite but outside the platform's datetime range; skip only this sample
+            stream_monitor.record_invalid(device_id or DEFAULT_DEVICE_ID, 'invalid_timestamp')
+            print(f"⚠️ Skipping frame sample with bad timestamp {timestamp!r}: {e}")
+            continue
+        latest_device_id = device_id or DEFAULT_DEVICE_ID
+        latest_hr = hr
+        latest_spo2 = spo2
+        latest_sensor_timestamp = sensor_timestamp
+        print(f"💓 Received HR: {latest_hr} BPM | 🫁 SpO2: {latest_spo2}%")
+        process_health_data(sample_time=timestamp)
+
+def parse_sample_time(value):
+    """Epoch seconds from a payload timestamp (epoch number or ISO string, naive = UTC); None if unusable"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return None
+
+def remember_device(device_id, state):
+    """Store a device's last reading, evicting the least recently updated device beyond the cap"""
+    with device_state_lock:
+        device_state[device_id] = state
+        device_state.move_to_end(device_id)
+        while len(device_state) > MONITOR_MAX_DEVICES:
+            device_state.popitem(last=False)
+
+def device_states():
+    """Copy of device_state, least recently updated first"""
+    with device_state_lock:
+        return dict(device_state)
+
+def process_health_data(sample_time=None):
+    """Process health data and make predictions (sample_time: sensor epoch seconds, default now)"""
     global latest_hr, latest_spo2
 
     print(f"\n🔬 Processing: HR={latest_hr}, SpO2={latest_spo2}")
 
     # Run ML predictions
-    predictions = predict_health_status(latest_hr, latest_spo2)
+    predictions = predict_health_status(latest_hr, latest_spo2, device_id=latest_device_id)
+
+    processed_at = time.time()
+    if sample_time is None:
+        sample_time = processed_at
+    remember_device(latest_device_id, {
+        'HeartRate': latest_hr,
+        'SpO2': latest_spo2,
+        'sensor_timestamp': latest_sensor_timestamp,
+        'status': predictions['status'],
+        'processed_at': processed_at
+    })
+    # Batched frames carry many samples per message, so the ring and the sinks use the sample time
+    recent_history.append(latest_device_id, sample_time, latest_hr, latest_spo2, predictions)
 
     print(f"📊 Predictions:")
     print(f"   - Anomaly: {predictions['anomaly']}")
@@ -537,11 +970,20 @@ def process_health_data():
     print(f"   - Tachycardia: {predictions['tachycardia']}")
     print(f"   - Status: {predictions['status']}")
 
-    # Write to OPC UA
-    write_to_opcua(latest_hr, latest_spo2, predictions)
-
-    # Write to Firebase
-    write_to_firebase(latest_hr, latest_spo2, predictions)
+    # Fan out to every sink (critical readings jump each sink's routine queue)
+    critical = is_critical_reading(latest_hr, latest_spo2, predictions)
+    if critical:
+        print("🚨 Critical reading → priority lanes")
+    sink_dispatcher.dispatch({
+        'key': generate_push_key(),  # fixed per reading, so a snapshot replay overwrites instead of duplicating
+        'device_id': latest_device_id,
+        'HeartRate': latest_hr,
+        'SpO2': latest_spo2,
+        'sensor_timestamp': latest_sensor_timestamp,
+        'sample_time': sample_time,
+        'predictions': predictions,
+        'enqueued_at': time.time()
+    }, critical=critical)
 
     print("-" * 60)
 
@@ -616,6 +1058,38 @@ def status():
         **predictions
     })
 
+@app.route('/monitor')
+@app.route('/monitor/<device_id>')
+def monitor(device_id=None):
+    summary = stream_monitor.summary(device_id)
+    if summary is None:
+        return jsonify({"error": f"Unknown device: {device_id}"}), 404
+    return jsonify(summary)
+
+@app.route('/recent')
+def recent():
+    """
+    Recent readings for one device from the in-memory ring buffer
+    Query: device_id, seconds (default RECENT_HISTORY_MINUTES), limit, format=json|binary
+    """
+    device_id = request.args.get('device_id', latest_device_id)
+    seconds = request.args.get('seconds', RECENT_HISTORY_MINUTES * 60, type=float)
+    limit = request.args.get('limit', type=int)
+
+    columns = recent_history.query(device_id, since=time.time() - seconds, limit=limit)
+    if columns is None:
+        return jsonify({"error": f"Unknown device: {device_id}", "devices": recent_history.device_ids()}), 404
+
+    count = len(columns['t'])
+    if request.args.get('format') == 'binary':
+        return Response(to_bytes(columns), mimetype='application/octet-stream',
+                        headers={'X-Device-Id': device_id, 'X-Count': str(count)})
+    return jsonify({"device_id": device_id, "count": count, "flag_bits": FLAG_BITS, **to_json(columns)})
+
+@app.route('/sinks')
+def sinks():
+    return jsonify(sink_dispatcher.stats())
+
 # =========================
 # MAIN FUNCTION
 # =========================
@@ -624,9 +1098,15 @@ def main():
     print("🏥 IoT HEALTH MONITORING SYSTEM - BACKEND")
     print("="*60 + "\n")
 
-    # Initialize connections
-    mqtt_ok = init_mqtt()
+    # Register sinks, then restore state (incl. their pending readings) before anything runs
+    register_sinks()
+    restore_snapshot()
+
+    # Initialize connections (sinks first, so the first MQTT message has somewhere to go)
     opcua_ok = connect_opcua()
+    sink_dispatcher.start()
+    start_snapshots()
+    mqtt_ok = init_mqtt()
 
     if not mqtt_ok:
         print("⚠️  Warning: MQTT init failed. Check your HiveMQ credentials and broker URL.")
@@ -12,6 +12,7 @@ from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
+from vitals_frame import encode_frame, sample_in_range, validate_device_id, MAX_SAMPLES
 
 load_dotenv()
 
@@ -22,8 +23,15 @@ MQTT_USERNAME = os.getenv("MQTT_USERNAME")
 MQTT_PASSWORD = os.getenv("MQTT_PASSWORD")
 MQTT_TOPIC_HR = os.getenv("MQTT_TOPIC_HR", "sensors/hr")
 MQTT_TOPIC_SPO2 = os.getenv("MQTT_TOPIC_SPO2", "sensors/spo2")
+MQTT_TOPIC_VITALS = os.getenv("MQTT_TOPIC_VITALS", "sensors/vitals")
 INTERVAL = float(os.getenv("DATA_GENERATION_INTERVAL", 2.0))
 
+# Payload format: "json" (two messages per sample) or "binary" (one combined frame)
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json").lower()
+DEVICE_ID = os.getenv("DEVICE_ID", "excel_publisher")
+# Binary only: samples buffered per frame (gateway batching)
+BATCH_SIZE = max(1, min(int(os.getenv("BATCH_SIZE", 1)), MAX_SAMPLES))
+
 # Your Excel dataset path
 EXCEL_PATH = r"D:\Semester 7\DTCA Project\iot-health-dashboard\patients_data_with_alerts.xlsx"
 
@@ -72,6 +80,13 @@ def main():
         print("❌ No data to publish.")
         return
 
+    if PAYLOAD_FORMAT == "binary":
+        try:
+            validate_device_id(DEVICE_ID)
+        except ValueError as e:
+            print(f"❌ Invalid DEVICE_ID: {e}")
+            return
+
     client = mqtt.Client(client_id="excel_health_publisher")
     if MQTT_USERNAME:
         client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
@@ -87,8 +102,11 @@ def main():
     idx = 0
     last_hr = None
     last_spo2 = None
+    batch = []
 
     print(f"🚀 Publishing data from Excel every {INTERVAL} seconds…")
+    if PAYLOAD_FORMAT == "binary":
+        print(f"📦 Binary frames on {MQTT_TOPIC_VITALS} ({BATCH_SIZE} sample(s) per frame)")
 
     try:
         while True:
@@ -106,24 +124,38 @@ def main():
             if spo2 is None: spo2 = last_spo2
             else: last_spo2 = spo2
 
-            timestamp = datetime.utcnow().isoformat()
-
-            hr_payload = {
-                "value": hr,
-                "timestamp": timestamp,
-                "unit": "BPM"
-            }
-
-            spo2_payload = {
-                "value": spo2,
-                "timestamp": timestamp,
-                "unit": "%"
-            }
-
-            client.publish(MQTT_TOPIC_HR, json.dumps(hr_payload), qos=1)
-            client.publish(MQTT_TOPIC_SPO2, json.dumps(spo2_payload), qos=1)
-
-            print(f"📡 [{idx+1}/{len(rows)}] HR={hr}, SpO2={spo2} → sent")
+            if PAYLOAD_FORMAT == "binary":
+                if hr is None or spo2 is None:
+                    print(f"⚠️ [{idx+1}/{len(rows)}] No HR/SpO2 yet — skipped")
+                elif not sample_in_range(hr, spo2):
+                    print(f"⚠️ [{idx+1}/{len(rows)}] HR={hr}, SpO2={spo2} out of range — skipped")
+                else:
+                    batch.append((time.time(), hr, spo2))
+                    if len(batch) >= BATCH_SIZE:
+                        client.publish(MQTT_TOPIC_VITALS, encode_frame(DEVICE_ID, batch), qos=1)
+                        print(f"📡 [{idx+1}/{len(rows)}] HR={hr}, SpO2={spo2} → sent ({len(batch)} in frame)")
+                        batch = []
+                    else:
+                        print(f"🗃️ [{idx+1}/{len(rows)}] HR={hr}, SpO2={spo2} → buffered ({len(batch)}/{BATCH_SIZE})")
+            else:
+                timestamp = datetime.utcnow().isoformat()
+
+                hr_payload = {
+                    "value": hr,
+                    "timestamp": timestamp,
+                    "unit": "BPM"
+                }
+
+                spo2_payload = {
+                    "value": spo2,
+                    "timestamp": timestamp,
+                    "unit": "%"
+                }
+
+                client.publish(MQTT_TOPIC_HR, json.dumps(hr_payload), qos=1)
+                client.publish(MQTT_TOPIC_SPO2, json.dumps(spo2_payload), qos=1)
+
+                print(f"📡 [{idx+1}/{len(rows)}] HR={hr}, SpO2={spo2} → sent")
 
             idx += 1
             if idx >= len(rows):   # Loop again
@@ -135,6 +167,9 @@ def main():
         print("\n⏹️ Stopped by user")
 
     finally:
+        if batch:
+            client.publish(MQTT_TOPIC_VITALS, encode_frame(DEVICE_ID, batch), qos=1)
+            print(f"📡 Flushed {len(batch)} buffered sample(s)")
         client.loop_stop()
         client.disconnect()
         print("👋 Publisher stopped")
@@ -0,0 +1,186 @@
+"""
+Recent History - bounded in-memory ring buffer of processed readings
+- One fixed-capacity columnar buffer per device (NumPy: time, HR, SpO2, flag bits);
+  capacity counts readings, so the time it covers depends on the reading rate
+- O(1) append, slice queries without a Firebase round trip
+- Memory: capacity * 12 bytes per device, capped at max_devices
+
+Binary layout (to_bytes), little-endian, n = count:
+    time f64[n] | heart rate i16[n] | spo2 u8[n] | flags u8[n]
+
+Snapshots (save/load) use a memory-mappable .npy table of RECORD_DTYPE, one row per device.
+"""
+
+import base64
+import os
+import threading
+import numpy as np
+
+# Flag bits packed into the flags column
+FLAG_BITS = {
+    'anomaly': 1,
+    'arrhythmia': 2,
+    'bradycardia': 4,
+    'tachycardia': 8
+}
+
+COLUMNS = (
+    ('t', '<f8'),
+    ('HeartRate', '<i2'),
+    ('SpO2', 'u1'),
+    ('flags', 'u1')
+)
+RECORD_DTYPE = np.dtype(list(COLUMNS))
+
+
+def prediction_flags(predictions):
+    """Pack the prediction booleans into a flag byte"""
+    flags = 0
+    for key, bit in FLAG_BITS.items():
+        if predictions.get(key):
+            flags |= bit
+    return flags
+
+
+class _DeviceRing:
+    """Fixed-capacity columnar ring for one device"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self.head = 0  # next write position
+        self.size = 0
+
+    def append(self, t, hr, spo2, flags):
+        i = self.head
+        self.columns['t'][i] = t
+        self.columns['HeartRate'][i] = min(max(int(hr), -32768), 32767)
+        self.columns['SpO2'][i] = min(max(int(spo2), 0), 255)
+        self.columns['flags'][i] = flags
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def ordered(self):
+        """Copy of every column in chronological order"""
+        if self.size < self.capacity:
+            return {name: col[:self.size].copy() for name, col in self.columns.items()}
+        return {name: np.concatenate((col[self.head:], col[:self.head])) for name, col in self.columns.items()}
+
+
+class RecentHistory:
+    """Thread-safe per-device ring buffers"""
+
+    def __init__(self, capacity=1800, max_devices=1000):
+        if capacity < 1:
+            raise ValueError(f"recent history capacity must be >= 1, got {capacity}")
+        self.capacity = capacity
+        self.max_devices = max_devices
+        self.devices = {}
+        self.appended = 0  # total appends, lets snapshots skip unchanged buffers
+        self._lock = threading.Lock()
+
+    def append(self, device_id, t, hr, spo2, predictions):
+        """Record one processed reading; new devices beyond max_devices are ignored"""
+        flags = prediction_flags(predictions)
+        with self._lock:
+            ring = self.devices.get(device_id)
+            if ring is None:
+                if len(self.devices) >= self.max_devices:
+                    return False
+                ring = self.devices[device_id] = _DeviceRing(self.capacity)
+            ring.append(t, hr, spo2, flags)
+            self.appended += 1
+            return True
+
+    def query(self, device_id, since=None, limit=None):
+        """
+        Slice of a device's history in arrival order
+        since: only readings with t >= since; limit: at most the newest `limit` readings
+        (t is the sample time, which late frames can make non-monotonic, so `since` is a mask)
+        Output: {column: ndarray} or None for an unknown device
+        """
+        with self._lock:
+            ring = self.devices.get(device_id)
+            if ring is None:
+                return None
+            columns = ring.ordered()
+
+        if since is not None:
+            keep = columns['t'] >= since
+            columns = {name: col[keep] for name, col in columns.items()}
+        if limit is not None:
+            start = max(0, len(columns['t']) - limit)
+            columns = {name: col[start:] for name, col in columns.items()}
+        return columns
+
+    def device_ids(self):
+        with self._lock:
+            return sorted(self.devices)
+
+    def save(self, path):
+        """
+        Write every ring to a .npy file (one chronological row of RECORD_DTYPE per device) that
+        np.load(..., mmap_mode='r') can map without parsing; written atomically (temp + rename).
+        Returns the small JSON header needed by load().
+        """
+        with self._lock:
+            device_ids = list(self.devices)
+            table = np.zeros((len(device_ids), self.capacity), dtype=RECORD_DTYPE)
+            sizes = []
+            for row, device_id in enumerate(device_ids):
+                columns = self.devices[device_id].ordered()
+                n = len(columns['t'])
+                for name, _ in COLUMNS:
+                    table[name][row, :n] = columns[name]
+                sizes.append(n)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, table)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return {'file': os.path.basename(path), 'capacity': self.capacity, 'devices': device_ids, 'sizes': sizes}
+
+    def load(self, path, header):
+        """Restore rings written by save() (keeps the newest readings if capacity shrank)"""
+        table = np.load(path, mmap_mode='r')
+        if table.dtype != RECORD_DTYPE or table.shape[0] != len(header['devices']):
+            raise ValueError(f"recent history file does not match its header: {path}")
+        self._replace({
+            device_id: {name: table[name][row, :n] for name, _ in COLUMNS}
+            for row, (device_id, n) in enumerate(zip(header['devices'], header['sizes']))
+        })
+
+    def load_state(self, state):
+        """Restore the base64 JSON layout of version 2 snapshots"""
+        self._replace({
+            device_id: {
+                name: np.frombuffer(base64.b64decode(encoded[name]), dtype=dtype)
+                for name, dtype in COLUMNS
+            }
+            for device_id, encoded in state['devices'].items()
+        })
+
+    def _replace(self, device_columns):
+        """Swap in rings built from {device_id: {column: chronological array}}"""
+        devices = {}
+        for device_id, columns in list(device_columns.items())[:self.max_devices]:
+            ring = devices[device_id] = _DeviceRing(self.capacity)
+            n = min(len(columns['t']), self.capacity)
+            for name, col in columns.items():
+                ring.columns[name][:n] = col[len(col) - n:]
+            ring.size = n
+            ring.head = n % self.capacity
+        with self._lock:
+            self.devices = devices
+
+
+def to_json(columns):
+    """Columnar JSON body for a query() result"""
+    return {name: col.tolist() for name, col in columns.items()}
+
+
+def to_bytes(columns):
+    """Packed binary body for a query() result (see module docstring for the layout)"""
+    return b''.join(columns[name].astype(dtype, copy=False).tobytes() for name, dtype in COLUMNS)
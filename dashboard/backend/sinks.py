@@ -0,0 +1,389 @@
+"""
+Sinks - pluggable fan-out of processed readings
+- A sink declares its batching, coalescing, concurrency and backlog limits
+- Every registered sink gets its own queues and worker threads, so a slow or
+  failing sink only degrades itself
+- Critical readings go through a per-sink priority lane (own worker + connection)
+  whose latency is tracked against an SLO; a failed critical write is retried after reconnecting
+- pending() includes readings still being written, so a snapshot replay is
+  at-least-once: sinks should write idempotently (e.g. keyed by reading['key'])
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+# Reconnect backoff after a failed write: 1 s, 2 s, 4 s, ... capped at 30 s
+RECONNECT_BACKOFF_S = 1.0
+RECONNECT_BACKOFF_MAX_S = 30.0
+# Attempts per critical reading (reconnecting in between) before it is given up
+CRITICAL_MAX_ATTEMPTS = 5
+
+
+class Sink:
+    """
+    Base class for reading destinations
+    Subclasses implement write() and optionally connect()/close()
+    A failed write closes the worker's connection and reconnects with backoff
+    """
+    name = 'sink'
+    max_batch = 1        # routine readings handed to write() at once
+    coalesce = False     # routine lane drains its backlog and writes only the newest reading
+    current_value = False  # sink also holds "current value" state (coalescing sinks always do)
+    concurrency = 1      # routine workers (each with its own connect()); must be 1 for current-value sinks
+    queue_size = 200     # routine backlog; the oldest reading is shed beyond this
+
+    def __init__(self, name=None, max_batch=None, coalesce=None, current_value=None, concurrency=None,
+                 queue_size=None):
+        if name is not None:
+            self.name = name
+        if current_value is not None:
+            self.current_value = current_value
+        if max_batch is not None:
+            self.max_batch = max_batch
+        if coalesce is not None:
+            self.coalesce = coalesce
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if queue_size is not None:
+            self.queue_size = queue_size
+
+    def connect(self, lane):
+        """Open a connection for one worker ('critical' or 'routine'); passed back to write()"""
+        return None
+
+    def close(self, conn):
+        """Release a connection from connect() before reconnecting"""
+        pass
+
+    def write(self, readings, conn, current=True):
+        """
+        Write a list of readings; return True on success (exceptions count as failures)
+        current: False when a newer critical reading is queued, so current-value state must be left alone
+        """
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """Append readings as JSON lines to a local file"""
+    name = 'file'
+    max_batch = 100
+    queue_size = 1000
+
+    def __init__(self, path, **options):
+        super().__init__(**options)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def connect(self, lane):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        return open(self.path, 'a', encoding='utf-8')
+
+    def close(self, conn):
+        if conn is not None:
+            conn.close()
+
+    def write(self, readings, conn, current=True):
+        lines = ''.join(json.dumps(r, separators=(',', ':'), default=str) + '\n' for r in readings)
+        with self._lock:
+            conn.write(lines)
+            conn.flush()
+        return True
+
+
+class _SinkRunner:
+    """Queues, workers and counters for one registered sink"""
+
+    def __init__(self, sink, critical_slo_ms):
+        self.sink = sink
+        self.critical_slo_ms = critical_slo_ms
+        self.critical_queue = queue.Queue()
+        self.routine_queue = queue.Queue(maxsize=sink.queue_size)
+        # enqueued_at of the newest critical reading, set when it is queued (not when written)
+        self.last_critical_at = 0.0
+        # enqueued_at of the newest reading written as the current value (guarded by current_lock)
+        self.last_current_at = 0.0
+        self.lock = threading.Lock()
+        # Serialises current-value writes so a routine write can't land after a newer critical one
+        self.current_lock = threading.Lock()
+        # Readings handed to write() but not finished yet: token -> (lane, readings)
+        self.in_flight = {}
+        self.stats = {
+            'written': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'shed': 0,
+            'critical_written': 0,
+            'critical_failed': 0,
+            'critical_retries': 0,
+            'reconnects': 0,
+            'slo_breaches': 0,
+            'last_critical_latency_ms': None,
+            'max_critical_latency_ms': 0.0
+        }
+
+    def start(self):
+        name = self.sink.name
+        threading.Thread(target=self._critical_loop, name=f"{name}-critical", daemon=True).start()
+        for i in range(self.sink.concurrency):
+            threading.Thread(target=self._routine_loop, name=f"{name}-routine-{i}", daemon=True).start()
+
+    def put(self, reading, critical):
+        if critical:
+            with self.lock:
+                self.last_critical_at = max(self.last_critical_at, reading['enqueued_at'])
+            self.critical_queue.put(reading)
+            return
+
+        # Never block the producer: shed this sink's oldest routine reading when full
+        while True:
+            try:
+                self.routine_queue.put_nowait(reading)
+                return
+            except queue.Full:
+                try:
+                    self.routine_queue.get_nowait()
+                    with self.lock:
+                        self.stats['shed'] += 1
+                except queue.Empty:
+                    pass
+
+    def _connect(self, lane):
+        """Open a connection, retrying with backoff until it succeeds"""
+        failures = 0
+        while True:
+            try:
+                return self.sink.connect(lane)
+            except Exception as e:
+                failures += 1
+                print(f"⚠️ Sink '{self.sink.name}' {lane} connection failed: {e}")
+                self._backoff(lane, failures)
+
+    def _reconnect(self, lane, conn, failures):
+        """Back off after a failed write, drop the old connection and open a new one"""
+        self._backoff(lane, failures)
+        try:
+            self.sink.close(conn)
+        except Exception as e:
+            print(f"⚠️ Sink '{self.sink.name}' {lane} close failed: {e}")
+        with self.lock:
+            self.stats['reconnects'] += 1
+        return self._connect(lane)
+
+    def _backoff(self, lane, failures):
+        delay = min(RECONNECT_BACKOFF_S * 2 ** (failures - 1), RECONNECT_BACKOFF_MAX_S)
+        print(f"🔁 Sink '{self.sink.name}' {lane}: retrying in {delay:.0f}s (failure #{failures})")
+        time.sleep(delay)
+
+    def _write(self, lane, readings, conn, current=True, final=True, track=True):
+        """
+        Hand readings to the sink; returns True on success
+        final: count a failure in the stats (False while the caller will retry)
+        track: list the readings in in_flight (False if the caller already does)
+        """
+        token = object()
+        if track:
+            with self.lock:
+                self.in_flight[token] = (lane, readings)
+        try:
+            ok = bool(self.sink.write(readings, conn, current=current))
+        except Exception as e:
+            print(f"⚠️ Sink '{self.sink.name}' write failed: {e}")
+            traceback.print_exc()
+            ok = False
+        with self.lock:
+            if track:
+                del self.in_flight[token]
+            if ok or final:
+                self.stats['written' if ok else 'failed'] += len(readings)
+        return ok
+
+    def _write_critical(self, reading, conn, final):
+        if not self._tracks_current():
+            return self._write('critical', [reading], conn, final=final, track=False)
+
+        # Waits for at most one in-flight routine write of the current value
+        with self.current_lock:
+            # A retried reading may have been overtaken by a newer routine write meanwhile
+            current = reading['enqueued_at'] >= self.last_current_at
+            if not current and self.sink.coalesce:
+                return True
+            ok = self._write('critical', [reading], conn, current=current, final=final, track=False)
+            if ok and current:
+                self.last_current_at = reading['enqueued_at']
+            return ok
+
+    def _critical_loop(self):
+        conn = self._connect('critical')
+        failures = 0
+        while True:
+            reading = self.critical_queue.get()
+            # Stays in in_flight across retries so a snapshot taken during a backoff still has it
+            token = object()
+            with self.lock:
+                self.in_flight[token] = ('critical', [reading])
+            try:
+                # Writes are idempotent (keyed by reading['key']), so a failed attempt is retried
+                for attempt in range(1, CRITICAL_MAX_ATTEMPTS + 1):
+                    ok = self._write_critical(reading, conn, final=attempt == CRITICAL_MAX_ATTEMPTS)
+                    failures = 0 if ok else failures + 1
+                    if ok:
+                        break
+                    conn = self._reconnect('critical', conn, failures)
+                    if attempt < CRITICAL_MAX_ATTEMPTS:
+                        with self.lock:
+                            self.stats['critical_retries'] += 1
+            finally:
+                with self.lock:
+                    del self.in_flight[token]
+
+            if not ok:
+                with self.lock:
+                    self.stats['critical_failed'] += 1
+                print(f"🚨 Sink '{self.sink.name}': critical reading dropped after "
+                      f"{CRITICAL_MAX_ATTEMPTS} attempts")
+                continue
+
+            latency_ms = (time.time() - reading['enqueued_at']) * 1000
+            with self.lock:
+                self.stats['critical_written'] += 1
+                self.stats['last_critical_latency_ms'] = round(latency_ms, 1)
+                self.stats['max_critical_latency_ms'] = max(self.stats['max_critical_latency_ms'],
+                                                            round(latency_ms, 1))
+                breached = latency_ms > self.critical_slo_ms
+                if breached:
+                    self.stats['slo_breaches'] += 1
+            if breached:
+                print(f"⏱️ Sink '{self.sink.name}': critical reading took {latency_ms:.0f} ms "
+                      f"(SLO {self.critical_slo_ms:.0f} ms)")
+
+    def _routine_loop(self):
+        conn = self._connect('routine')
+        failures = 0
+        while True:
+            batch = [self.routine_queue.get()]
+            limit = self.sink.queue_size if self.sink.coalesce else self.sink.max_batch
+            while len(batch) < limit:
+                try:
+                    batch.append(self.routine_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if self.sink.coalesce:
+                # Only the newest value matters
+                with self.lock:
+                    self.stats['coalesced'] += len(batch) - 1
+                batch = batch[-1:]
+
+            if not self._tracks_current():
+                ok = self._write('routine', batch, conn)
+            else:
+                # Never let current-value state fall back behind a queued critical reading
+                with self.current_lock:
+                    current = not self._is_stale(batch[-1])
+                    if not current and self.sink.coalesce:
+                        with self.lock:
+                            self.stats['coalesced'] += 1
+                        continue
+                    ok = self._write('routine', batch, conn, current=current)
+                    if ok and current:
+                        self.last_current_at = max(self.last_current_at, batch[-1]['enqueued_at'])
+
+            failures = 0 if ok else failures + 1
+            if failures:
+                conn = self._reconnect('routine', conn, failures)
+
+    def _tracks_current(self):
+        return self.sink.coalesce or self.sink.current_value
+
+    def _is_stale(self, reading):
+        """True if a critical reading newer than this one has been queued"""
+        with self.lock:
+            return reading['enqueued_at'] < self.last_critical_at
+
+
+class SinkDispatcher:
+    """Registry of sinks; fans every reading out to all of them"""
+
+    def __init__(self, critical_slo_ms=500):
+        self.critical_slo_ms = critical_slo_ms
+        self.runners = {}
+        self.started = False
+
+    def register(self, sink):
+        """Add a sink (before start())"""
+        if self.started:
+            raise RuntimeError("register sinks before starting the dispatcher")
+        if sink.name in self.runners:
+            raise ValueError(f"sink already registered: {sink.name}")
+        if (sink.coalesce or sink.current_value) and sink.concurrency != 1:
+            # Parallel routine workers finish out of order and could move the current value backwards
+            raise ValueError(f"sink '{sink.name}' holds a current value and needs concurrency=1, "
+                             f"got {sink.concurrency}")
+        self.runners[sink.name] = _SinkRunner(sink, self.critical_slo_ms)
+        print(f"🔌 Registered sink '{sink.name}' (batch={sink.max_batch}, coalesce={sink.coalesce}, "
+              f"workers={sink.concurrency}, backlog={sink.queue_size})")
+
+    def start(self):
+        """Start every sink's workers"""
+        for runner in self.runners.values():
+            runner.start()
+        self.started = True
+        print(f"🚦 Sink dispatcher started: {', '.join(self.runners) or 'no sinks'} "
+              f"(critical SLO {self.critical_slo_ms:.0f} ms)")
+
+    def dispatch(self, reading, critical=False):
+        """Queue a reading on every sink; returns immediately"""
+        for runner in self.runners.values():
+            runner.put(reading, critical)
+
+    def stats(self):
+        result = {}
+        for name, runner in self.runners.items():
+            sink = runner.sink
+            with runner.lock:
+                result[name] = {
+                    **runner.stats,
+                    'critical_queued': runner.critical_queue.qsize(),
+                    'routine_queued': runner.routine_queue.qsize(),
+                    'max_batch': sink.max_batch,
+                    'coalesce': sink.coalesce,
+                    'concurrency': sink.concurrency,
+                    'queue_size': sink.queue_size
+                }
+        return {'critical_slo_ms': self.critical_slo_ms, 'sinks': result}
+
+    def pending(self):
+        """Readings in flight or still queued per sink, without consuming them (for snapshots)"""
+        result = {}
+        for name, runner in self.runners.items():
+            with runner.lock:
+                in_flight = list(runner.in_flight.values())
+            with runner.critical_queue.mutex, runner.routine_queue.mutex:
+                result[name] = {
+                    lane: [r for flight_lane, readings in in_flight if flight_lane == lane for r in readings]
+                    + list(q.queue)
+                    for lane, q in (('critical', runner.critical_queue), ('routine', runner.routine_queue))
+                }
+        return result
+
+    def restore_pending(self, pending):
+        """Re-queue readings returned by pending(); unknown sinks are skipped. Returns the count."""
+        restored = 0
+        for name, queues in pending.items():
+            runner = self.runners.get(name)
+            if runner is None:
+                continue
+            for reading in queues.get('critical', []):
+                runner.critical_queue.put(reading)
+                restored += 1
+            for reading in queues.get('routine', []):
+                try:
+                    runner.routine_queue.put_nowait(reading)
+                    restored += 1
+                except queue.Full:
+                    break
+        return restored
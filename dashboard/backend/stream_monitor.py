@@ -0,0 +1,273 @@
+"""
+Stream Monitor - online model-drift and data-quality statistics
+- Per device and fleet-wide, updated in O(1) per reading with fixed memory
+- Input distributions: fixed-bin histograms (frozen baseline + decayed recent window)
+- Per-model flag rates, model-vs-rule disagreement rates, invalid input rates
+"""
+
+import math
+import threading
+
+MODEL_KEYS = ('anomaly', 'arrhythmia', 'bradycardia', 'tachycardia')
+
+# Population Stability Index above this is treated as drift (common rule of thumb)
+PSI_DRIFT_THRESHOLD = 0.2
+
+
+class _Histogram:
+    """Fixed-bin histogram: baseline of the first N values + exponentially decayed recent window"""
+
+    def __init__(self, lo, hi, bins, baseline_size, decay):
+        self.lo = lo
+        self.width = (hi - lo) / bins
+        self.bins = bins
+        self.baseline_size = baseline_size
+        self.decay = decay
+        self.baseline = [0] * bins
+        self.baseline_count = 0
+        self.recent = [0.0] * bins
+        self.recent_total = 0.0
+        self._weight = 1.0
+
+    def add(self, value):
+        i = min(max(int((value - self.lo) / self.width), 0), self.bins - 1)
+        if self.baseline_count < self.baseline_size:
+            self.baseline[i] += 1
+            self.baseline_count += 1
+
+        # Decay by growing the weight of new samples instead of shrinking every bin
+        self.recent[i] += self._weight
+        self.recent_total += self._weight
+        self._weight /= self.decay
+        if self._weight > 1e12:
+            # Amortised O(1): renormalise once every few thousand samples
+            self.recent = [c / self._weight for c in self.recent]
+            self.recent_total /= self._weight
+            self._weight = 1.0
+
+    def psi(self):
+        """Population Stability Index of the recent window against the baseline"""
+        if self.baseline_count < self.baseline_size or not self.recent_total:
+            return None
+        eps = 1e-4
+        total = 0.0
+        for b, r in zip(self.baseline, self.recent):
+            p = max(b / self.baseline_count, eps)
+            q = max(r / self.recent_total, eps)
+            total += (q - p) * math.log(q / p)
+        return total
+
+    def to_state(self):
+        # Copies: the snapshot is serialised outside the monitor lock
+        return {'baseline': list(self.baseline), 'baseline_count': self.baseline_count,
+                'recent': list(self.recent), 'recent_total': self.recent_total, 'weight': self._weight}
+
+    def load_state(self, state):
+        if len(state['baseline']) != self.bins or len(state['recent']) != self.bins:
+            return  # bin layout changed since the snapshot; start fresh
+        self.baseline = list(state['baseline'])
+        self.baseline_count = state['baseline_count']
+        self.recent = list(state['recent'])
+        self.recent_total = state['recent_total']
+        self._weight = state['weight']
+
+    def to_dict(self):
+        psi = self.psi()
+        return {
+            'lo': self.lo,
+            'bin_width': self.width,
+            'baseline': list(self.baseline),
+            'recent': [round(c / self.recent_total, 4) if self.recent_total else 0.0 for c in self.recent],
+            'psi': None if psi is None else round(psi, 4),
+            'drift': psi is not None and psi > PSI_DRIFT_THRESHOLD
+        }
+
+
+class _Rate:
+    """Cumulative count plus an exponentially weighted recent rate"""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.total = 0
+        self.hits = 0
+        self.recent = 0.0
+
+    def add(self, hit):
+        self.total += 1
+        self.hits += 1 if hit else 0
+        self.recent += self.alpha * ((1.0 if hit else 0.0) - self.recent)
+
+    def to_state(self):
+        return {'total': self.total, 'hits': self.hits, 'recent': self.recent}
+
+    def load_state(self, state):
+        self.total = state['total']
+        self.hits = state['hits']
+        self.recent = state['recent']
+
+    def to_dict(self):
+        return {
+            'count': self.hits,
+            'total': self.total,
+            'rate': round(self.hits / self.total, 4) if self.total else 0.0,
+            'recent_rate': round(self.recent, 4)
+        }
+
+
+class _StreamStats:
+    """All statistics kept for one device (or the whole fleet)"""
+
+    def __init__(self, baseline_size, decay):
+        alpha = 1.0 - decay
+        self.readings = 0
+        self.hr = _Histogram(0, 250, 50, baseline_size, decay)
+        self.spo2 = _Histogram(50, 101, 51, baseline_size, decay)
+        self.invalid = _Rate(alpha)
+        self.invalid_reasons = {}
+        self.fallback = _Rate(alpha)
+        self.model_flags = {k: _Rate(alpha) for k in MODEL_KEYS}
+        self.model_errors = {k: 0 for k in MODEL_KEYS}
+        self.rule_flags = {k: _Rate(alpha) for k in MODEL_KEYS}
+        self.disagreement = {k: _Rate(alpha) for k in MODEL_KEYS}
+
+    def record_prediction(self, hr, spo2, model_flags, rule_flags, invalid_fields, fallback):
+        self.readings += 1
+        self.invalid.add(bool(invalid_fields))
+        for field in invalid_fields:
+            self.invalid_reasons[field] = self.invalid_reasons.get(field, 0) + 1
+        if not invalid_fields:
+            self.hr.add(hr)
+            self.spo2.add(spo2)
+
+        self.fallback.add(fallback)
+        for key in MODEL_KEYS:
+            rule = bool(rule_flags[key])
+            self.rule_flags[key].add(rule)
+            model = model_flags.get(key)
+            if model is None:
+                # model missing or its predict() raised
+                self.model_errors[key] += 1
+                continue
+            self.model_flags[key].add(model)
+            self.disagreement[key].add(model != rule)
+
+    def record_invalid(self, reason):
+        self.invalid.add(True)
+        self.invalid_reasons[reason] = self.invalid_reasons.get(reason, 0) + 1
+
+    def to_state(self):
+        return {
+            'readings': self.readings,
+            'hr': self.hr.to_state(),
+            'spo2': self.spo2.to_state(),
+            'invalid': self.invalid.to_state(),
+            'invalid_reasons': dict(self.invalid_reasons),
+            'fallback': self.fallback.to_state(),
+            'model_flags': {k: r.to_state() for k, r in self.model_flags.items()},
+            'model_errors': dict(self.model_errors),
+            'rule_flags': {k: r.to_state() for k, r in self.rule_flags.items()},
+            'disagreement': {k: r.to_state() for k, r in self.disagreement.items()}
+        }
+
+    def load_state(self, state):
+        self.readings = state['readings']
+        self.hr.load_state(state['hr'])
+        self.spo2.load_state(state['spo2'])
+        self.invalid.load_state(state['invalid'])
+        self.invalid_reasons = dict(state['invalid_reasons'])
+        self.fallback.load_state(state['fallback'])
+        for key in MODEL_KEYS:
+            self.model_flags[key].load_state(state['model_flags'][key])
+            self.model_errors[key] = state['model_errors'][key]
+            self.rule_flags[key].load_state(state['rule_flags'][key])
+            self.disagreement[key].load_state(state['disagreement'][key])
+
+    def to_dict(self):
+        return {
+            'readings': self.readings,
+            'invalid': {**self.invalid.to_dict(), 'reasons': dict(self.invalid_reasons)},
+            'rule_fallback': self.fallback.to_dict(),
+            'models': {
+                key: {
+                    'flags': self.model_flags[key].to_dict(),
+                    'rule_flags': self.rule_flags[key].to_dict(),
+                    'disagreement': self.disagreement[key].to_dict(),
+                    'unavailable': self.model_errors[key]
+                }
+                for key in MODEL_KEYS
+            },
+            'inputs': {'HeartRate': self.hr.to_dict(), 'SpO2': self.spo2.to_dict()}
+        }
+
+
+class StreamMonitor:
+    """Thread-safe per-device + fleet monitor; memory is bounded by max_devices"""
+
+    def __init__(self, max_devices=1000, baseline_size=500, decay=0.995):
+        self.max_devices = max_devices
+        self.baseline_size = baseline_size
+        self.decay = decay
+        self.fleet = _StreamStats(baseline_size, decay)
+        self.devices = {}
+        self.untracked_readings = 0
+        self._lock = threading.Lock()
+
+    def _device(self, device_id):
+        stats = self.devices.get(device_id)
+        if stats is None:
+            if len(self.devices) >= self.max_devices:
+                # Fleet stats still see the reading; only the per-device view is skipped
+                self.untracked_readings += 1
+                return None
+            stats = self.devices[device_id] = _StreamStats(self.baseline_size, self.decay)
+        return stats
+
+    def record_prediction(self, device_id, hr, spo2, model_flags, rule_flags, invalid_fields=(), fallback=False):
+        """
+        Record one prediction
+        model_flags: {model: bool|None} (None = model unavailable or failed)
+        rule_flags: rule-based predictions for the same input
+        """
+        with self._lock:
+            for stats in (self.fleet, self._device(device_id)):
+                if stats is not None:
+                    stats.record_prediction(hr, spo2, model_flags, rule_flags, invalid_fields, fallback)
+
+    def record_invalid(self, device_id, reason):
+        """Record an input that never reached the models (unparseable payload, bad frame, ...)"""
+        with self._lock:
+            for stats in (self.fleet, self._device(device_id)):
+                if stats is not None:
+                    stats.record_invalid(reason)
+
+    def summary(self, device_id=None):
+        """Fleet summary (default) or one device's statistics; None for an unknown device"""
+        with self._lock:
+            if device_id is not None:
+                stats = self.devices.get(device_id)
+                return None if stats is None else {'device_id': device_id, **stats.to_dict()}
+            return {
+                'fleet': self.fleet.to_dict(),
+                'devices': sorted(self.devices),
+                'untracked_readings': self.untracked_readings,
+                'psi_drift_threshold': PSI_DRIFT_THRESHOLD
+            }
+
+    def to_state(self):
+        """JSON-serialisable copy of all statistics (for snapshots)"""
+        with self._lock:
+            return {
+                'fleet': self.fleet.to_state(),
+                'devices': {d: stats.to_state() for d, stats in self.devices.items()},
+                'untracked_readings': self.untracked_readings
+            }
+
+    def load_state(self, state):
+        """Restore statistics written by to_state()"""
+        with self._lock:
+            self.fleet.load_state(state['fleet'])
+            self.devices = {}
+            for device_id, device_state in list(state['devices'].items())[:self.max_devices]:
+                stats = self.devices[device_id] = _StreamStats(self.baseline_size, self.decay)
+                stats.load_state(device_state)
+            self.untracked_readings = state['untracked_readings']
@@ -0,0 +1,101 @@
+"""
+Vitals Frame - compact binary combined HR/SpO2 payload
+- One MQTT message carries device id + one or more (timestamp, HR, SpO2) samples
+- Shared by the publisher (encode) and the Flask backend (decode)
+
+Layout (little-endian):
+    header : magic "VT" | version u8 | sample count u8 | device id 16 bytes (NUL padded)
+    sample : timestamp f64 (unix seconds) | heart rate u16 | spo2 u8
+
+A single sample frame is 31 bytes, versus ~130 bytes for the two JSON messages.
+Device ids longer than 16 UTF-8 bytes, out-of-range samples and non-finite timestamps
+are rejected (ValueError).
+"""
+
+import math
+import struct
+
+FRAME_MAGIC = b"VT"
+FRAME_VERSION = 1
+DEVICE_ID_LEN = 16
+MAX_SAMPLES = 255
+
+HEADER = struct.Struct("<2sBB16s")
+SAMPLE = struct.Struct("<dHB")
+
+HR_MAX = 0xFFFF
+SPO2_MAX = 0xFF
+
+
+def validate_device_id(device_id):
+    """Encoded device id; raises ValueError if it does not fit the header"""
+    raw_id = str(device_id).encode("utf-8")
+    if not raw_id or len(raw_id) > DEVICE_ID_LEN:
+        raise ValueError(f"device id must be 1..{DEVICE_ID_LEN} UTF-8 bytes, got {device_id!r}")
+    return raw_id
+
+
+def sample_in_range(hr, spo2):
+    """True if the sample can be packed (HR u16, SpO2 u8)"""
+    return 0 <= int(hr) <= HR_MAX and 0 <= int(spo2) <= SPO2_MAX
+
+
+def encode_frame(device_id, samples):
+    """
+    Pack samples into a binary frame
+    Input: device_id (str), samples (iterable of (timestamp, hr, spo2))
+    Output: bytes
+    """
+    samples = list(samples)
+    if not 1 <= len(samples) <= MAX_SAMPLES:
+        raise ValueError(f"frame must carry 1..{MAX_SAMPLES} samples, got {len(samples)}")
+
+    raw_id = validate_device_id(device_id)
+    for timestamp, hr, spo2 in samples:
+        if not sample_in_range(hr, spo2):
+            raise ValueError(f"sample out of range: HR={hr!r}, SpO2={spo2!r}")
+        if not math.isfinite(timestamp):
+            raise ValueError(f"sample timestamp is not finite: {timestamp!r}")
+
+    buf = bytearray(HEADER.size + SAMPLE.size * len(samples))
+    HEADER.pack_into(buf, 0, FRAME_MAGIC, FRAME_VERSION, len(samples), raw_id)
+
+    offset = HEADER.size
+    for timestamp, hr, spo2 in samples:
+        SAMPLE.pack_into(buf, offset, float(timestamp), int(hr), int(spo2))
+        offset += SAMPLE.size
+    return bytes(buf)
+
+
+def is_frame(payload):
+    """True if the payload starts with the binary frame magic (JSON never does)"""
+    return len(payload) >= HEADER.size and memoryview(payload)[:2] == FRAME_MAGIC
+
+
+def decode_frame(payload):
+    """
+    Unpack a binary frame without copying the payload
+    Input: payload (bytes|bytearray|memoryview)
+    Output: (device_id, [(timestamp, hr, spo2), ...])
+    Raises ValueError on a malformed frame
+    """
+    view = memoryview(payload)
+    if len(view) < HEADER.size:
+        raise ValueError(f"frame too short: {len(view)} bytes")
+
+    magic, version, count, raw_id = HEADER.unpack_from(view, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"bad frame magic: {magic!r}")
+    if version != FRAME_VERSION:
+        raise ValueError(f"unsupported frame version: {version}")
+
+    end = HEADER.size + count * SAMPLE.size
+    if len(view) < end:
+        raise ValueError(f"truncated frame: expected {end} bytes, got {len(view)}")
+
+    device_id = raw_id.rstrip(b"\0").decode("utf-8", "replace")
+    samples = list(SAMPLE.iter_unpack(view[HEADER.size:end]))
+    for timestamp, _, _ in samples:
+        if not math.isfinite(timestamp):
+            raise ValueError(f"sample timestamp is not finite: {timestamp!r}")
+    return device_id, samples